@@ -73,6 +73,12 @@ def _get_ha_brightness(hass: HomeAssistant, entity_id: str):
     return (ha_bright / 255 * 100) if ha_bright is not None else 0.0
 
 
+def _guard_seconds(cached):
+    # Dynamic guard window: sweep duration + API settle buffer for active transitions,
+    # just the settle buffer for stopped entries.
+    return cached["sweep"] + API_SETTLE_SECONDS if cached["dir"] != "none" else API_SETTLE_SECONDS
+
+
 def resolve_current_brightness(tracker_key, reported_brightness):
     # During a dimming transition, the Hue API (and therefore HA's entity state) reports
     # brightness as though the transition happened instantaneously. If a transition stops
@@ -88,12 +94,8 @@ def resolve_current_brightness(tracker_key, reported_brightness):
     now = time.time()
     elapsed = now - cached["time"]
 
-    # Dynamic guard window: sweep duration + API settle buffer for active transitions,
-    # just the settle buffer for stopped entries.
-    guard_seconds = cached["sweep"] + API_SETTLE_SECONDS if cached["dir"] != "none" else API_SETTLE_SECONDS
-
     # Guard expired — trust the reported brightness and prune the cache entry
-    if elapsed > guard_seconds:
+    if elapsed > _guard_seconds(cached):
         BRIGHTNESS_CACHE.pop(tracker_key, None)
         return reported_brightness
 
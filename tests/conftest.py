@@ -3,6 +3,23 @@ from unittest.mock import AsyncMock, MagicMock
 import pytest
 
 
+def pytest_addoption(parser):
+    parser.addoption("--soak", action="store_true", default=False, help="Run the real-time soak tests")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "soak: real-time soak test, only run with --soak")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--soak"):
+        return
+    skip_soak = pytest.mark.skip(reason="Soak tests only run with --soak")
+    for item in items:
+        if "soak" in item.keywords:
+            item.add_marker(skip_soak)
+
+
 @pytest.fixture
 def mock_bridge():
     bridge = MagicMock()
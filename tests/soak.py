@@ -0,0 +1,434 @@
+# Soak-test harness for the raise/lower/stop service handlers.
+#
+# Replays dimmer-switch traffic (long holds with repeat events every 800 ms, press/release
+# storms, idle gaps) from many rooms spread over several simulated bridges, while sampling
+# event-loop lag, tracemalloc growth, BRIGHTNESS_CACHE size and per-bridge request rates.
+# Results are checked against soak_thresholds.json: "regression" thresholds fail the soak,
+# "advisory" ones (Hue's documented request rate, known baseline behaviour) are reported as
+# warnings. Regression metrics are normalised per room or per targeted resource, so the same
+# file holds for any --rooms/--bridges topology.
+#
+# Run a long soak from the repo root:
+#   python -m tests.soak --duration 3600 --rooms 24 --bridges 3
+
+import argparse
+import asyncio
+import gc
+import json
+import random
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import custom_components.hue_dimmer as hue_dimmer
+from custom_components.hue_dimmer.const import DEFAULT_MAX_BRIGHTNESS, DEFAULT_MIN_BRIGHTNESS
+
+THRESHOLDS_PATH = Path(__file__).with_name("soak_thresholds.json")
+
+REPEAT_INTERVAL = 0.8  # Hue dimmer switches emit a repeat event every 800 ms while held
+AWAY_SECONDS = (20.0, 40.0)  # Quiet spell longer than the tracker guard window, so entries go stale
+
+
+@dataclass
+class SoakConfig:
+    duration: float = 60.0
+    rooms: int = 12
+    bridges: int = 3
+    lights_per_room: int = 3
+    # Share of rooms targeting their lights individually rather than the room's grouped_light
+    individual_light_share: float = 0.25
+    sweep_time: float = 4.0
+    bridge_latency: tuple = (0.02, 0.08)
+    sample_interval: float = 0.05
+    seed: int = 1
+
+
+class SimulatedHass:
+    # Just enough of HomeAssistant for the handlers: hass.states.get(entity_id).attributes
+    def __init__(self):
+        self._states = {}
+        self.states = SimpleNamespace(get=self._states.get)
+
+    def add_light(self, entity_id, is_group=False):
+        attrs = {"brightness": 128, "supported_color_modes": ["color_temp"]}
+        if is_group:
+            attrs["is_hue_group"] = True
+        self._states[entity_id] = SimpleNamespace(attributes=attrs)
+
+    def set_brightness(self, entity_id, percent):
+        self._states[entity_id].attributes["brightness"] = round(percent / 100 * 255)
+
+
+class SimulatedBridge:
+    # Mimics the CLIP v2 behaviour the integration relies on: a transition is reported as
+    # though it completed instantly, and a stop reports where the light actually halted.
+    def __init__(self, name, hass, rng, latency):
+        self.name = name
+        self.api = self
+        self._hass = hass
+        self._rng = rng
+        self._latency = latency
+        self._entities = {}  # resource_id -> entity_id
+        self._rooms = {}  # resource_id -> room
+        self._transitions = {}  # resource_id -> (start_time, start_bright, target, duration)
+        self.total_requests = 0
+        # Whole-bridge peaks, plus the peaks any single room puts on the bridge. The per-room
+        # figures don't depend on how many rooms share the bridge.
+        self.peak_rate = 0
+        self.peak_room_rate = 0
+        self.inflight = 0
+        self.peak_inflight = 0
+        self.peak_room_inflight = 0
+        self._room_inflight = Counter()
+        self._buckets = {}  # None for the whole bridge, else room -> [second, requests in it]
+
+    def add_resource(self, resource_id, entity_id, room):
+        self._entities[resource_id] = entity_id
+        self._rooms[resource_id] = room
+
+    async def request(self, method, path, json=None):
+        resource_id = path.rsplit("/", 1)[-1]
+        room = self._rooms.get(resource_id)
+        self.total_requests += 1
+        self.peak_rate = max(self.peak_rate, self._count_request(None))
+        self.peak_room_rate = max(self.peak_room_rate, self._count_request(room))
+        self.inflight += 1
+        self._room_inflight[room] += 1
+        self.peak_inflight = max(self.peak_inflight, self.inflight)
+        self.peak_room_inflight = max(self.peak_room_inflight, self._room_inflight[room])
+        try:
+            await asyncio.sleep(self._rng.uniform(*self._latency))
+            if method == "put" and json is not None:
+                self._apply(resource_id, json)
+        finally:
+            self.inflight -= 1
+            self._room_inflight[room] -= 1
+
+    def _count_request(self, key):
+        # Fixed one-second buckets keep memory flat however long the soak runs
+        second = int(time.monotonic())
+        bucket = self._buckets.setdefault(key, [second, 0])
+        if bucket[0] != second:
+            bucket[:] = [second, 0]
+        bucket[1] += 1
+        return bucket[1]
+
+    def _actual_brightness(self, resource_id):
+        entity_id = self._entities[resource_id]
+        reported = self._hass.states.get(entity_id).attributes["brightness"] / 255 * 100
+        transition = self._transitions.get(resource_id)
+        if not transition:
+            return reported
+        start, start_bright, target, duration = transition
+        progress = min((time.monotonic() - start) / duration, 1.0) if duration else 1.0
+        return start_bright + (target - start_bright) * progress
+
+    def _apply(self, resource_id, payload):
+        entity_id = self._entities.get(resource_id)
+        if entity_id is None:
+            return
+        if payload.get("dimming_delta", {}).get("action") == "stop":
+            halted = self._actual_brightness(resource_id)
+            self._transitions.pop(resource_id, None)
+            self._hass.set_brightness(entity_id, halted)
+        elif "dimming" in payload:
+            target = payload["dimming"]["brightness"]
+            duration = payload.get("dynamics", {}).get("duration", 0) / 1000
+            self._transitions[resource_id] = (time.monotonic(), self._actual_brightness(resource_id), target, duration)
+            self._hass.set_brightness(entity_id, target)
+
+
+@dataclass
+class SoakReport:
+    metrics: dict
+    thresholds: dict
+    failures: list = field(default_factory=list)
+    warnings: list = field(default_factory=list)
+
+    @property
+    def passed(self):
+        return not self.failures
+
+    def format(self):
+        lines = [f"Soak {'PASSED' if self.passed else 'FAILED'}"]
+        for name, value in self.metrics.items():
+            lines.append(f"  {name:<36} {value:>12.2f}" if isinstance(value, float) else f"  {name:<36} {value:>12}")
+        lines.extend(f"  FAIL: {failure}" for failure in self.failures)
+        lines.extend(f"  WARN: {warning}" for warning in self.warnings)
+        return "\n".join(lines)
+
+
+def load_thresholds(path=THRESHOLDS_PATH):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def evaluate(metrics, thresholds):
+    # Every threshold is an upper bound on the metric of the same name minus its "max_" prefix.
+    # A threshold naming no metric is a failure, so a typo or rename can't disable a check.
+    failures = []
+    for name, limit in thresholds.items():
+        metric = name.removeprefix("max_")
+        if metric not in metrics:
+            failures.append(f"{name} does not match any soak metric")
+        elif metrics[metric] > limit:
+            failures.append(f"{metric} = {metrics[metric]:.2f} exceeds {limit}")
+    return failures
+
+
+def _stale_tracker_entries(now):
+    # Entries past their guard window are never consulted again; they linger until the same
+    # resource is dimmed, because resolve_current_brightness only prunes on read.
+    stale = 0
+    for cached in list(hue_dimmer.BRIGHTNESS_CACHE.values()):
+        if now - cached["time"] > hue_dimmer._guard_seconds(cached):
+            stale += 1
+    return stale
+
+
+def _build_topology(config, hass, rng):
+    bridges = [SimulatedBridge(f"bridge-{i}", hass, rng, config.bridge_latency) for i in range(config.bridges)]
+    resources = {}  # entity_id -> (bridge, resource_type, resource_id)
+    rooms = []  # list of target entity_id lists
+
+    for room in range(config.rooms):
+        bridge = bridges[room % len(bridges)]
+        group_entity = f"light.room_{room}"
+        hass.add_light(group_entity, is_group=True)
+        resources[group_entity] = (bridge, "grouped_light", f"{bridge.name}-group-{room}")
+        bridge.add_resource(f"{bridge.name}-group-{room}", group_entity, room)
+
+        light_entities = []
+        for light in range(config.lights_per_room):
+            entity_id = f"light.room_{room}_{light}"
+            resource_id = f"{bridge.name}-light-{room}-{light}"
+            hass.add_light(entity_id)
+            resources[entity_id] = (bridge, "light", resource_id)
+            bridge.add_resource(resource_id, entity_id, room)
+            light_entities.append(entity_id)
+
+        rooms.append(light_entities if rng.random() < config.individual_light_share else [group_entity])
+
+    return bridges, resources, rooms
+
+
+@contextmanager
+def _patched_lookups(resources):
+    async def _extract(call):
+        return set(call.data.get("entity_id", []))
+
+    async def _get_bridge_and_id(hass, entity_id):
+        return resources.get(entity_id, (None, None, None))
+
+    # Plain functions rather than mocks: a mock would record every call and skew the memory samples
+    with (
+        patch.object(hue_dimmer, "async_extract_entity_ids", _extract),
+        patch.object(hue_dimmer, "get_bridge_and_id", _get_bridge_and_id),
+    ):
+        yield
+
+
+class _Dispatcher:
+    # Fires service calls as independent tasks, like HA does for automation actions,
+    # so slow bridge responses pile up instead of throttling the button traffic.
+    def __init__(self, hass, sweep_time):
+        self._hass = hass
+        self._sweep_time = sweep_time
+        self._tasks = set()
+        self._room_pending = Counter()  # first target entity -> calls still running for that room
+        self.calls = 0
+        self.peak_pending = 0
+        self.peak_room_pending = 0
+
+    def fire(self, service, entity_ids):
+        # SimpleNamespace rather than conftest's MagicMock: each MagicMock leaves class-level
+        # allocations behind, which would show up as growth over a long soak
+        call = SimpleNamespace(data={"entity_id": entity_ids, "sweep_time": self._sweep_time})
+        if service == "raise":
+            coro = hue_dimmer._handle_transition(self._hass, call, "up", DEFAULT_MAX_BRIGHTNESS)
+        elif service == "lower":
+            coro = hue_dimmer._handle_transition(self._hass, call, "down", DEFAULT_MIN_BRIGHTNESS)
+        else:
+            coro = hue_dimmer._handle_stop(self._hass, call)
+
+        room = entity_ids[0]
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        self._room_pending[room] += 1
+        task.add_done_callback(lambda t: self._finished(t, room))
+        self.calls += 1
+        self.peak_pending = max(self.peak_pending, len(self._tasks))
+        self.peak_room_pending = max(self.peak_room_pending, self._room_pending[room])
+
+    def _finished(self, task, room):
+        self._tasks.discard(task)
+        self._room_pending[room] -= 1
+
+    async def drain(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks)
+
+
+async def _sleep_until(seconds, deadline):
+    # Sleeps for the requested time, cut short at the deadline; returns False once it has passed
+    await asyncio.sleep(max(min(seconds, deadline - time.monotonic()), 0))
+    return time.monotonic() < deadline
+
+
+async def _room_traffic(dispatcher, entity_ids, rng, deadline):
+    while time.monotonic() < deadline:
+        scenario = rng.choices(["hold", "storm", "idle", "away"], weights=[5, 2, 3, 1])[0]
+        direction = rng.choice(["raise", "lower"])
+
+        if scenario == "hold":
+            # Initial press, a repeat event every 800 ms while held, then release. The button
+            # is released at the deadline so no transition is left running.
+            dispatcher.fire(direction, entity_ids)
+            held = True
+            for _ in range(rng.randint(1, 8)):
+                if not await _sleep_until(REPEAT_INTERVAL, deadline):
+                    held = False
+                    break
+                dispatcher.fire(direction, entity_ids)
+            if held:
+                await _sleep_until(rng.uniform(0, REPEAT_INTERVAL), deadline)
+            dispatcher.fire("stop", entity_ids)
+        elif scenario == "storm":
+            for _ in range(rng.randint(3, 12)):
+                dispatcher.fire(rng.choice(["raise", "lower"]), entity_ids)
+                await _sleep_until(rng.uniform(0.05, 0.2), deadline)
+                dispatcher.fire("stop", entity_ids)
+                if not await _sleep_until(rng.uniform(0.05, 0.2), deadline):
+                    break
+        elif scenario == "idle":
+            await _sleep_until(rng.uniform(0.5, 3.0), deadline)
+        else:
+            await _sleep_until(rng.uniform(*AWAY_SECONDS), deadline)
+
+
+async def _sample(config, stats, deadline):
+    loop = asyncio.get_running_loop()
+    lag_histogram = Counter()  # whole milliseconds -> samples, so hours of sampling stay small
+
+    while time.monotonic() < deadline:
+        start = loop.time()
+        await asyncio.sleep(config.sample_interval)
+        lag_ms = max(loop.time() - start - config.sample_interval, 0.0) * 1000
+        lag_histogram[int(lag_ms)] += 1
+        stats["loop_lag_ms"] = max(stats["loop_lag_ms"], lag_ms)
+
+        stats["peak_tracker_entries"] = max(stats["peak_tracker_entries"], len(hue_dimmer.BRIGHTNESS_CACHE))
+        stats["stale_tracker_entries"] = max(stats["stale_tracker_entries"], _stale_tracker_entries(time.time()))
+
+    remaining = sum(lag_histogram.values()) * 0.01
+    for lag_ms in sorted(lag_histogram, reverse=True):
+        remaining -= lag_histogram[lag_ms]
+        if remaining < 0:
+            stats["loop_lag_p99_ms"] = float(lag_ms)
+            break
+
+
+async def run_soak(config, thresholds=None):
+    thresholds = load_thresholds() if thresholds is None else thresholds
+    rng = random.Random(config.seed)
+    hass = SimulatedHass()
+    bridges, resources, rooms = _build_topology(config, hass, rng)
+    targeted = {resources[entity_id][2] for entity_ids in rooms for entity_id in entity_ids}
+    dispatcher = _Dispatcher(hass, config.sweep_time)
+    stats = {"peak_tracker_entries": 0, "stale_tracker_entries": 0, "loop_lag_ms": 0.0, "loop_lag_p99_ms": 0.0}
+
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    hue_dimmer.BRIGHTNESS_CACHE.clear()
+
+    try:
+        with _patched_lookups(resources):
+            gc.collect()
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+
+            deadline = time.monotonic() + config.duration
+            await asyncio.gather(
+                _sample(config, stats, deadline),
+                *(_room_traffic(dispatcher, entity_ids, random.Random(rng.random()), deadline) for entity_ids in rooms),
+            )
+            await dispatcher.drain()
+
+            # Retained memory and tracker state once every call has finished; a leak is what
+            # is still held here, not the transient allocations of in-flight calls.
+            gc.collect()
+            retained, peak = tracemalloc.get_traced_memory()
+            final_tracker_entries = len(hue_dimmer.BRIGHTNESS_CACHE)
+            stats["stale_tracker_entries"] = max(stats["stale_tracker_entries"], _stale_tracker_entries(time.time()))
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+        hue_dimmer.BRIGHTNESS_CACHE.clear()
+
+    # Thresholds apply to the normalised metrics below; raw counts are informational only.
+    metrics = {
+        "service_calls": dispatcher.calls,
+        "bridge_requests": sum(b.total_requests for b in bridges),
+        "loop_lag_ms": stats["loop_lag_ms"],
+        "loop_lag_p99_ms": stats["loop_lag_p99_ms"],
+        "memory_growth_kib": (retained - baseline) / 1024,
+        "memory_growth_kib_per_resource": (retained - baseline) / 1024 / len(targeted),
+        "peak_memory_kib": (peak - baseline) / 1024,
+        "peak_tracker_entries": stats["peak_tracker_entries"],
+        "final_tracker_entries": final_tracker_entries,
+        # Peak entries per resource the traffic actually dims; above 1.0 means keys are leaking
+        "tracker_ratio": stats["peak_tracker_entries"] / len(targeted),
+        "stale_tracker_entries": stats["stale_tracker_entries"],
+        "stale_tracker_ratio": stats["stale_tracker_entries"] / len(targeted),
+        "pending_calls": dispatcher.peak_pending,
+        "pending_calls_per_room": dispatcher.peak_room_pending,
+        "bridge_requests_per_second": max(b.peak_rate for b in bridges),
+        "bridge_requests_per_second_per_room": max(b.peak_room_rate for b in bridges),
+        "bridge_inflight_requests": max(b.peak_inflight for b in bridges),
+        "bridge_inflight_requests_per_room": max(b.peak_room_inflight for b in bridges),
+    }
+    failures = evaluate(metrics, thresholds["regression"])
+    warnings = evaluate(metrics, thresholds.get("advisory", {}))
+    return SoakReport(metrics, thresholds, failures, warnings)
+
+
+def main(argv=None):
+    defaults = SoakConfig()
+    parser = argparse.ArgumentParser(description="Soak-test the Hue Smooth Dimmer service handlers.")
+    parser.add_argument("--duration", type=float, default=defaults.duration, help="Seconds to run")
+    parser.add_argument("--rooms", type=int, default=defaults.rooms)
+    parser.add_argument("--bridges", type=int, default=defaults.bridges)
+    parser.add_argument("--lights-per-room", type=int, default=defaults.lights_per_room)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--thresholds", type=Path, default=THRESHOLDS_PATH)
+    args = parser.parse_args(argv)
+    if args.rooms < 1:
+        parser.error("--rooms must be at least 1")
+    if args.bridges < 1:
+        parser.error("--bridges must be at least 1")
+    if args.lights_per_room < 1:
+        parser.error("--lights-per-room must be at least 1")
+    if args.duration <= 0:
+        parser.error("--duration must be positive")
+
+    config = SoakConfig(
+        duration=args.duration,
+        rooms=args.rooms,
+        bridges=args.bridges,
+        lights_per_room=args.lights_per_room,
+        seed=args.seed,
+    )
+    report = asyncio.run(run_soak(config, load_thresholds(args.thresholds)))
+    print(report.format())
+    return 0 if report.passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+import time
+from unittest.mock import patch
+
+import pytest
+
+import custom_components.hue_dimmer as hue_dimmer
+from tests.soak import SoakConfig, _stale_tracker_entries, evaluate, load_thresholds, main, run_soak
+
+
+@pytest.mark.soak
+@pytest.mark.asyncio
+async def test_short_soak_within_thresholds():
+    report = await run_soak(SoakConfig(duration=3.0, rooms=6, bridges=2))
+
+    assert report.metrics["service_calls"] > 0
+    assert report.metrics["bridge_requests"] > 0
+    assert report.passed, report.format()
+
+
+@pytest.mark.asyncio
+async def test_soak_reports_every_thresholded_metric():
+    thresholds = load_thresholds()
+    report = await run_soak(SoakConfig(duration=0.5, rooms=2, bridges=1, lights_per_room=1), thresholds)
+
+    for section in ("regression", "advisory"):
+        for name in thresholds[section]:
+            assert name.removeprefix("max_") in report.metrics
+    assert report.metrics["tracker_ratio"] <= 1.0
+
+
+def test_stale_tracker_entries_counts_expired_guards():
+    now = time.time()
+    cache = {
+        ("light", "moving-expired"): {"time": now - 20, "bright": 50.0, "target": 100.0, "dir": "up", "sweep": 4.0},
+        ("light", "moving-guarded"): {"time": now - 18, "bright": 50.0, "target": 0.0, "dir": "down", "sweep": 4.0},
+        ("light", "stopped-expired"): {"time": now - 16, "bright": 30.0, "target": 30.0, "dir": "none", "sweep": 1.0},
+        ("light", "stopped-guarded"): {"time": now - 10, "bright": 30.0, "target": 30.0, "dir": "none", "sweep": 1.0},
+    }
+
+    with patch.dict(hue_dimmer.BRIGHTNESS_CACHE, cache, clear=True):
+        assert _stale_tracker_entries(now) == 2
+
+
+def test_evaluate_flags_exceeded_thresholds():
+    metrics = {"loop_lag_ms": 120.0, "tracker_ratio": 0.5}
+    thresholds = {"max_loop_lag_ms": 100, "max_tracker_ratio": 1.0}
+
+    failures = evaluate(metrics, thresholds)
+
+    assert failures == ["loop_lag_ms = 120.00 exceeds 100"]
+
+
+def test_evaluate_flags_unknown_metric():
+    metrics = {"loop_lag_ms": 12.0}
+    thresholds = {"max_loop_lag_ms": 100, "max_loop_lagg_ms": 100}
+
+    failures = evaluate(metrics, thresholds)
+
+    assert failures == ["max_loop_lagg_ms does not match any soak metric"]
+
+
+@pytest.mark.parametrize("argv", [["--rooms", "0"], ["--bridges", "0"], ["--duration", "0"]])
+def test_main_rejects_empty_topology(argv):
+    with pytest.raises(SystemExit) as exc:
+        main(argv)
+
+    assert exc.value.code == 2